@@ -4,23 +4,35 @@
 Written by qll (github.com/qll), distributed under the MIT license.
 """
 import argparse
-import base64
+import concurrent.futures
 import contextlib
 import email
 import email.mime.text
+import email.parser
+import email.utils
+import functools
 import imaplib
 import logging
 import logging.config
 import os
 import re
+import secrets
+import signal
 import smtplib
 import sqlite3
 import time
 
 
 class IMAPInbox:
+    # PEEK leaves the \Seen flag alone
+    FULL_MAIL = '(BODY.PEEK[])'
+    # everything needed to decide what to do with a mail
+    DISPATCH_HEADERS = '(BODY.PEEK[HEADER.FIELDS (FROM TO CC BCC SUBJECT)])'
+    # the empty line between header block and body
+    HEADER_END_REGEX = re.compile(rb'\r?\n\r?\n')
+
     def __init__(self, host, port, username, password, inbox='INBOX',
-                 ssl=False, startssl=False):
+                 ssl=False, startssl=False, batch_size=100):
         self.host = host
         self.port = port
         self.username = username
@@ -28,9 +40,21 @@ class IMAPInbox:
         self.inbox = inbox
         self.ssl = ssl
         self.startssl = startssl
+        self.batch_size = batch_size
         self.imap = None
+        self._pending_deletes = []
 
     def __enter__(self):
+        """Connect to the IMAP server unless the connection is still up."""
+        self.ensure_connected()
+        return self
+
+    def __exit__(self, type, value, traceback):
+        """Remove deleted messages but keep the connection for next time."""
+        self.flush_deletes()
+        self.imap.expunge()
+
+    def _connect(self):
         """Connect to the IMAP server."""
         if self.ssl:
             self.imap = imaplib.IMAP4_SSL(self.host, self.port)
@@ -41,31 +65,89 @@ class IMAPInbox:
             self.imap = imaplib.IMAP4(self.host, self.port)
         self.imap.login(self.username, self.password)
         self.imap.select(mailbox=self.inbox)
-        return self
 
-    def __exit__(self, type, value, traceback):
-        """Disconnect from the IMAP server."""
-        # remove deleted messages from mailbox
-        self.imap.close()
-        # be nice and say BYE to the server
-        self.imap.logout()
+    def ensure_connected(self):
+        """(Re)connect if there is no connection or the server dropped it."""
+        if self.imap is not None:
+            try:
+                if self.imap.noop()[0] == 'OK':
+                    return
+            except (imaplib.IMAP4.error, OSError):
+                pass
+        self._connect()
 
-    def fetch_all(self):
-        """Fetch all mail from the inbox."""
+    def close(self):
+        """Disconnect from the IMAP server."""
+        if self.imap is not None:
+            # remove deleted messages from mailbox
+            self.imap.close()
+            # be nice and say BYE to the server
+            self.imap.logout()
+            self.imap = None
+
+    def fetch_all(self, headers_only=False):
+        """Fetch all mail from the inbox, batch_size mails per FETCH command.
+
+        With headers_only only the headers relevant for dispatching are
+        downloaded, use fetch_full to get the complete mail afterwards.
+        """
         _, data = self.imap.search(None, 'ALL')
-        for mail_id in data[0].decode().split(' '):
-            if mail_id:
-                _, data = self.imap.fetch(mail_id, '(RFC822)')
-                yield mail_id, email.message_from_bytes(data[0][1])
+        mail_ids = data[0].decode().split()
+        parts = self.DISPATCH_HEADERS if headers_only else self.FULL_MAIL
+        for start in range(0, len(mail_ids), self.batch_size):
+            batch = mail_ids[start:start + self.batch_size]
+            _, data = self.imap.fetch(','.join(batch), parts)
+            for response in data:
+                # (b'<id> (BODY[] {<size>}', b'<mail>') tuples separated
+                # by b')'
+                if isinstance(response, tuple):
+                    mail_id = response[0].split(None, 1)[0].decode()
+                    yield mail_id, email.message_from_bytes(response[1])
+
+    def fetch_full(self, mail_id):
+        """Fetch a single complete mail as parsed headers and raw body.
+
+        Only the header block is parsed, the body is passed through as it is.
+        """
+        _, data = self.imap.fetch(mail_id, self.FULL_MAIL)
+        raw = data[0][1]
+        separator = self.HEADER_END_REGEX.search(raw)
+        end = separator.end() if separator else len(raw)
+        headers = email.parser.BytesHeaderParser().parsebytes(raw[:end])
+        return headers, raw[end:]
 
     def delete(self, mail_id):
-        """Mark a mail as deleted."""
-        self.imap.store(mail_id, '+FLAGS', '\\Deleted')
+        """Mark a mail as deleted (once flush_deletes is called)."""
+        self._pending_deletes.append(mail_id)
+
+    def delete_many(self, mail_ids):
+        """Mark several mails as deleted (once flush_deletes is called)."""
+        self._pending_deletes.extend(mail_ids)
+
+    def flush_deletes(self):
+        """Mark all pending mails as deleted with a single STORE command."""
+        if self._pending_deletes:
+            # SILENT: the server need not echo the new flags of every mail
+            self.imap.store(','.join(map(str, self._pending_deletes)),
+                            '+FLAGS.SILENT', '\\Deleted')
+            self._pending_deletes = []
+
+
+def _serialize_mail(mail):
+    """Serialize a message for sending it over SMTP."""
+    if isinstance(mail, bytes):
+        return mail
+    # SMTP wants CRLF line endings, bytes are transmitted as they are
+    policy = mail.policy.clone(linesep='\r\n')
+    return mail.as_bytes(policy=policy)
 
 
 class SMTPSender:
+    # seconds a connection may idle before it is checked with NOOP
+    KEEPALIVE_INTERVAL = 60
+
     def __init__(self, host, port, domain, username, password, ssl=False,
-                 startssl=False):
+                 startssl=False, connections=1, max_recipients=100):
         self.host = host
         self.port = port
         self.domain = domain
@@ -73,20 +155,38 @@ class SMTPSender:
         self.password = password
         self.ssl = ssl
         self.startssl = startssl
+        self.connections = connections
+        self.max_recipients = max_recipients
         self.smtp = None
+        self._last_used = 0
+        # additional senders for parallel delivery, created on demand
+        self._pool = []
 
     def __enter__(self):
         return self
 
     def __exit__(self, type, value, traceback):
+        for sender in [self] + self._pool:
+            try:
+                if sender.smtp is not None:
+                    sender.smtp.quit()
+            except smtplib.SMTPServerDisconnected:
+                pass
+
+    def _is_alive(self):
+        """Check an idle connection since servers drop them after a while."""
+        if time.monotonic() - self._last_used <= self.KEEPALIVE_INTERVAL:
+            return True
         try:
-            if self.smtp is not None:
-                self.smtp.quit()
+            return self.smtp.noop()[0] == 250
         except smtplib.SMTPServerDisconnected:
-            pass
+            return False
 
     def _connect(self):
-        """Connect to the SMTP server."""
+        """Connect to the SMTP server unless the connection is still up."""
+        if self.smtp is not None and not self._is_alive():
+            self.smtp.close()
+            self.smtp = None
         if self.smtp is None:
             if self.ssl:
                 self.smtp = smtplib.SMTP_SSL(self.host, self.port, self.domain)
@@ -97,14 +197,63 @@ class SMTPSender:
                 self.smtp = smtplib.SMTP(self.host, self.port, self.domain)
             self.smtp.login(self.username, self.password)
 
+    def _senders(self, count):
+        """Return count senders (at least one) with a connection each."""
+        count = max(count, 1)
+        while len(self._pool) < count - 1:
+            self._pool.append(SMTPSender(self.host, self.port, self.domain,
+                                         self.username, self.password,
+                                         self.ssl, self.startssl))
+        return [self] + self._pool[:count - 1]
+
     def send(self, from_, to, mail):
-        """Send mail. Connect lazily if required."""
+        """Send mail (a message or its serialized bytes). Connect lazily."""
+        self.send_raw(from_, to, _serialize_mail(mail))
+
+    def send_raw(self, from_, to, payload):
+        """Send an already serialized mail. Connect lazily if required."""
         self._connect()
+        mail_options = []
+        # forwarded mails may carry a raw 8bit body
+        if not payload.isascii() and self.smtp.has_extn('8bitmime'):
+            mail_options.append('BODY=8BITMIME')
         try:
-            self.smtp.sendmail(from_, to, mail.as_string())
+            self.smtp.sendmail(from_, to, payload, mail_options)
         except smtplib.SMTPServerDisconnected:
             self.smtp = None
-            self.send(from_, to, mail)
+            self.send_raw(from_, to, payload)
+        else:
+            self._last_used = time.monotonic()
+
+    def send_many(self, from_, recipients, mail):
+        """Send one mail to all recipients.
+
+        Recipients are split into transactions of at most max_recipients
+        (RFC 5321 only guarantees 100 per mail), which are spread over up to
+        self.connections parallel connections.
+        """
+        payload = _serialize_mail(mail)
+        recipients = list(recipients)
+        chunks = [recipients[i:i + self.max_recipients]
+                  for i in range(0, len(recipients), self.max_recipients)]
+        if not chunks:
+            return
+        senders = self._senders(min(len(chunks), self.connections))
+        if len(senders) == 1:
+            for chunk in chunks:
+                self.send_raw(from_, chunk, payload)
+            return
+
+        def deliver(sender, chunks):
+            for chunk in chunks:
+                sender.send_raw(from_, chunk, payload)
+
+        with concurrent.futures.ThreadPoolExecutor(len(senders)) as pool:
+            futures = [pool.submit(deliver, sender, chunks[i::len(senders)])
+                       for i, sender in enumerate(senders)]
+        for future in futures:
+            # re-raise errors of the workers
+            future.result()
 
 
 class SQLiteStorage:
@@ -119,61 +268,165 @@ class SQLiteStorage:
         activation_key TEXT
     )
     '''
+    SUBSCRIBERS_INDEX_SQL = '''CREATE UNIQUE INDEX IF NOT EXISTS
+        idx_subscribers_email ON subscribers(email)'''
+    # run on every start so that existing databases get the indexes as well
+    INDEX_SQL = SUBSCRIBERS_INDEX_SQL + ''';
+    CREATE INDEX IF NOT EXISTS idx_unverified_email ON unverified(email)
+    '''
+    # seconds until the subscriber cache is reloaded from the database
+    CACHE_TTL = 30
 
     def __init__(self, path):
         db_existed = os.path.isfile(path)
         self._db = sqlite3.connect(path)
+        # WAL only syncs on checkpoints, which is plenty for a mailing list
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
         if not db_existed:
-            for statement in self.INITIAL_SQL.split(';'):
-                self._db.execute(statement)
+            self._db.executescript(self.INITIAL_SQL)
+        self._db.executescript(self.INDEX_SQL)
+        # a single cursor is reused for all queries
+        self._cursor = self._db.cursor()
+        # maps subscriber addresses to their deletion keys
+        self._subscriber_cache = None
+        self._cache_loaded_at = 0
+        # immutable copy of the cached addresses handed out for iteration
+        self._subscriber_snapshot = None
+
+    def _subscribers(self):
+        """Return the cached subscribers, reloading them when stale."""
+        now = time.monotonic()
+        if (self._subscriber_cache is None or
+                now - self._cache_loaded_at > self.CACHE_TTL):
+            self._subscriber_cache = dict(self._select_iter(
+                'SELECT email, deletion_key FROM subscribers'))
+            self._subscriber_snapshot = None
+            self._cache_loaded_at = now
+        return self._subscriber_cache
+
+    def _select(self, sql, params=[]):
+        """Run a read-only query, there is nothing to commit."""
+        if isinstance(params, str):
+            params = (params,)
+        self._cursor.execute(sql, params)
+        return self._cursor.fetchall()
 
-    def _query(self, sql, params=[]):
+    def _select_iter(self, sql, params=[]):
+        """Like _select, but stream the rows instead of fetching all."""
+        # needs a cursor of its own, the shared one may be reused meanwhile
+        return self._db.execute(sql, params)
+
+    def _execute(self, sql, params=[]):
+        """Run a statement which modifies the database and commit."""
         if isinstance(params, str):
             params = (params,)
-        with contextlib.closing(self._db.cursor()) as cursor:
-            cursor.execute(sql, params)
-            result = cursor.fetchall()
-            self._db.commit()
-            return result
+        self._cursor.execute(sql, params)
+        self._db.commit()
+
+    def _execute_many(self, sql, params_seq):
+        """Run a statement for many parameters, all or nothing."""
+        # commits on success, rolls back the whole batch on errors
+        with self._db:
+            self._cursor.executemany(sql, params_seq)
 
     def is_unverified(self, addr, activation_key):
-        return self._query('SELECT id FROM unverified WHERE email=? AND '
-                           'activation_key=?', (addr, activation_key))
+        return self._select('SELECT 1 FROM unverified WHERE email=? AND '
+                            'activation_key=? LIMIT 1', (addr, activation_key))
 
     def add_unverified(self, addr, activation_key):
-        self._query('INSERT INTO unverified (email, activation_key) VALUES '
-                    '(?, ?)', (addr, activation_key))
+        self._execute('INSERT INTO unverified (email, activation_key) VALUES '
+                      '(?, ?)', (addr, activation_key))
 
     def delete_unverified(self, addr):
-        self._query('DELETE FROM unverified WHERE email=?', addr)
+        self._execute('DELETE FROM unverified WHERE email=?', addr)
+
+    def purge_unverified(self, pairs):
+        """Delete many (addr, activation_key) pairs in one transaction."""
+        self._execute_many('DELETE FROM unverified WHERE email=? AND '
+                           'activation_key=?', pairs)
 
     def is_subscribed(self, addr, deletion_key=''):
-        sql = 'SELECT id FROM subscribers WHERE email=?'
-        params = [addr]
-        if deletion_key:
-            sql += ' AND deletion_key=?'
-            params.append(deletion_key)
-        return self._query(sql, params)
+        subscribers = self._subscribers()
+        if addr not in subscribers:
+            return False
+        return not deletion_key or subscribers[addr] == deletion_key
 
     def add_subscriber(self, addr, deletion_key):
-        self._query('INSERT INTO subscribers (email, deletion_key) VALUES '
-                    '(?, ?)', (addr, deletion_key))
+        self._execute('INSERT INTO subscribers (email, deletion_key) VALUES '
+                      '(?, ?)', (addr, deletion_key))
+        if self._subscriber_cache is not None:
+            self._subscriber_cache[addr] = deletion_key
+            self._subscriber_snapshot = None
+
+    def add_subscribers(self, pairs):
+        """Add many (addr, deletion_key) pairs in one transaction."""
+        pairs = list(pairs)
+        self._execute_many('INSERT INTO subscribers (email, deletion_key) '
+                           'VALUES (?, ?)', pairs)
+        if self._subscriber_cache is not None:
+            self._subscriber_cache.update(pairs)
+            self._subscriber_snapshot = None
+
+    def bulk_load(self, pairs):
+        """Like add_subscribers, but meant for importing large lists.
+
+        The email index is rebuilt once after all rows are inserted instead
+        of being updated per row. Everything happens in one transaction, so
+        a duplicate address rolls back the whole import.
+        """
+        pairs = list(pairs)
+        # DDL does not implicitly open a transaction, hence the explicit BEGIN
+        self._db.execute('BEGIN')
+        try:
+            self._db.execute('DROP INDEX IF EXISTS idx_subscribers_email')
+            self._db.executemany('INSERT INTO subscribers (email, '
+                                 'deletion_key) VALUES (?, ?)', pairs)
+            self._db.execute(self.SUBSCRIBERS_INDEX_SQL)
+        except Exception:
+            self._db.rollback()
+            raise
+        self._db.commit()
+        if self._subscriber_cache is not None:
+            self._subscriber_cache.update(pairs)
+            self._subscriber_snapshot = None
 
     def get_deletion_key(self, addr):
-        return self._query('SELECT deletion_key FROM subscribers WHERE '
-                           'email=?', addr)[0][0]
+        return self._subscribers()[addr]
 
     def delete_subscriber(self, addr):
-        self._query('DELETE FROM subscribers WHERE email=?', addr)
-
-    def get_subscribers(self):
-        return (i[0] for i in self._query('SELECT email FROM subscribers'))
+        self._execute('DELETE FROM subscribers WHERE email=?', addr)
+        if self._subscriber_cache is not None:
+            self._subscriber_cache.pop(addr, None)
+            self._subscriber_snapshot = None
+
+    def get_subscribers(self, exclude=()):
+        subscribers = self._subscribers()
+        if self._subscriber_snapshot is None:
+            # immutable, so callers may change subscriptions while iterating
+            self._subscriber_snapshot = tuple(subscribers)
+        if not exclude:
+            return iter(self._subscriber_snapshot)
+        exclude = frozenset(exclude)
+        return (addr for addr in self._subscriber_snapshot
+                if addr not in exclude)
 
 
 class UserError(Exception):
     pass
 
 
+class _LazyStr:
+    """Call func only when the string is needed, e.g. for log messages
+    which are not filtered out by the log level."""
+    def __init__(self, func, *args):
+        self.func = func
+        self.args = args
+
+    def __str__(self):
+        return str(self.func(*self.args))
+
+
 def assert_managing_subscriptions(func):
     """Assert that manage_subscriptions has been enabled."""
     def wrapper(self, *args, **kwargs):
@@ -202,15 +455,49 @@ def assert_is_subscriber(func):
     return wrapper
 
 
+@functools.lru_cache(maxsize=None)
+def _load_template(language, name):
+    """Read an i18n mail template. Templates never change at runtime."""
+    with open('./i18n/{0}/{1}'.format(language, name), 'r') as template:
+        return template.read()
+
+
+@functools.lru_cache(maxsize=256)
+def _parse_mail_addrs(header_value):
+    """Parse the addresses in a header. The same To/Cc headers recur a lot."""
+    return tuple(addr for _, addr in email.utils.getaddresses([header_value]))
+
+
 class Manager:
-    VERIFY_REGEX = re.compile(r'verify <([A-Za-z0-9+=/]+?)>')
-    UNSUBSCRIBE_REGEX = re.compile(r'unsubscribe <([A-Za-z0-9+=/]+?)>')
-    CLEAN_SUBJECT_REGEX = re.compile(r'^(?:\w{2,3}:\s*)*(.*)$')
+    # subjects which trigger a command, mapped to the method name
+    COMMANDS = {
+        'subscribe': 'subscribe',
+        'unsubscribe': 'send_deletion_key',
+    }
+    # keys are URL-safe base64, older keys may still contain "+/="
+    ACTION_REGEX = re.compile(r'(verify|unsubscribe) <([\w+=/-]+?)>')
+    # reply and forward markers like "Re: Fwd: " in front of a subject
+    REPLY_MARKERS_REGEX = re.compile(r'(?:\w{2,3}:\s*)*')
+    MAIL_ADDR_REGEX = re.compile(r'[\w.%+-]+@[\w.%+-]+')
+    ASCII_MAIL_TEMPLATE = ('Content-Type: text/plain; charset="us-ascii"\n'
+                           'MIME-Version: 1.0\n'
+                           'Content-Transfer-Encoding: 7bit\n'
+                           'Subject: {subject}\n'
+                           'From: {from_}\n'
+                           'To: {to}\n'
+                           '\n'
+                           '{text}')
+    # headers which survive forwarding (lowercase, header names are case
+    # insensitive), everything else is deleted
+    HEADER_WHITELIST = frozenset(('from', 'to', 'subject', 'date', 'reply-to',
+                                  'content-type', 'content-transfer-encoding',
+                                  'in-reply-to', 'references', 'message-id'))
 
     def __init__(self, mail_addr, inbox, sender, storage,
                  subject_prefix='[List]', skip_sender=True,
                  manage_subscriptions=True, default_language='en'):
         self.mail_addr = mail_addr
+        self._mail_addr_lower = mail_addr.lower()
         self.inbox = inbox
         self.sender = sender
         self.storage = storage
@@ -220,16 +507,21 @@ class Manager:
         self.default_language = default_language
 
         # automated mail list response emails
-        self.SUBSCRIPTION_MAIL_TEXT = open("./i18n/{0}/subscription_mail.txt".format(self.default_language), 'r').read()
-        self.VERIFICATION_MAIL_TEXT = open("./i18n/{0}/verification_mail.txt".format(self.default_language), 'r').read()
-        self.UNSUBSCRIBE_MAIL_TEXT = open("./i18n/{0}/unsubscribe_mail.txt".format(self.default_language), 'r').read()
-        self.DELETION_KEY_MAIL_TEXT = open("./i18n/{0}/deletion_key_mail.txt".format(self.default_language), 'r').read()
+        self.SUBSCRIPTION_MAIL_TEXT = _load_template(
+            self.default_language, 'subscription_mail.txt')
+        self.VERIFICATION_MAIL_TEXT = _load_template(
+            self.default_language, 'verification_mail.txt')
+        self.UNSUBSCRIBE_MAIL_TEXT = _load_template(
+            self.default_language, 'unsubscribe_mail.txt')
+        self.DELETION_KEY_MAIL_TEXT = _load_template(
+            self.default_language, 'deletion_key_mail.txt')
 
     def _extract_mail_addrs(self, header_value):
         if header_value is None:
             return []
         # let's not allow too fancy mail addresses
-        return re.findall(r'[\w.%+-]+@[\w.%+-]+', header_value)
+        return [addr for addr in _parse_mail_addrs(str(header_value))
+                if self.MAIL_ADDR_REGEX.fullmatch(addr)]
 
     def _get_sender(self, mail):
         """Get sender from an email message."""
@@ -241,31 +533,61 @@ class Manager:
         sender = self._get_sender(mail)
         return '<{}, subject "{}">'.format(sender, mail.get('Subject', ''))
 
+    def _list_subject(self, subject):
+        """Return the subject with the list prefix in front of it."""
+        if subject is None:
+            return '%s (empty subject)' % self.subject_prefix
+        if subject.lstrip().startswith(self.subject_prefix):
+            return subject
+        markers = self.REPLY_MARKERS_REGEX.match(subject)
+        clean_subject = subject[markers.end():]
+        if clean_subject.strip().startswith(self.subject_prefix):
+            return subject
+        return '%s %s' % (self.subject_prefix, clean_subject)
+
     def _clean_mail(self, mail):
-        """Delete unknown header fields but do not destroy the message"""
-        whitelist = ('From', 'To', 'Subject', 'Date', 'Reply-To',
-                     'Content-Type', 'Content-Transfer-Encoding',
-                     'In-Reply-To', 'References', 'Message-ID')
-        for header in mail.keys():
-            if header not in whitelist:
-                del mail[header]
+        """Delete unknown header fields and set the list headers"""
+        subject = mail.get('Subject')
+        list_subject = self._list_subject(subject)
+        # rebuild the header list in one pass, deleting or replacing headers
+        # one by one rescans the whole list every time
+        headers = [(name, list_subject if name.lower() == 'subject' else value)
+                   for name, value in mail._headers
+                   if name.lower() in self.HEADER_WHITELIST]
+        if subject is None:
+            headers.append(('Subject', list_subject))
+        headers.append(('List-Post', '<mailto:%s>' % self.mail_addr))
+        mail._headers = headers
 
     def _create_mail(self, from_, to, subject, text):
+        subject = '{} {}'.format(self.subject_prefix, subject)
+        if all(part.isascii() for part in (from_, to, subject, text)):
+            # plain ASCII mails need no encoding and are put together directly
+            # as bytes instead of going through the email package
+            mail = self.ASCII_MAIL_TEMPLATE.format(
+                from_=from_, to=to, subject=subject, text=text)
+            return mail.replace('\r\n', '\n').replace('\n', '\r\n').encode()
         mail = email.mime.text.MIMEText(text)
-        mail['Subject'] = '{} {}'.format(self.subject_prefix, subject)
+        mail['Subject'] = subject
         mail['From'] = from_
         mail['To'] = to
         return mail
 
     def _create_unique_key(self):
-        return base64.b64encode(os.urandom(16)).decode()
+        return secrets.token_urlsafe(16)
 
     def is_directed_at_list(self, mail):
-        addrs = (self._extract_mail_addrs(mail.get('To')) +
-                 self._extract_mail_addrs(mail.get('Cc', '')) +
-                 self._extract_mail_addrs(mail.get('Bcc', '')))
-        return any(self.mail_addr == addr
-                   for addr in addrs)
+        # mail clients love to change the case of addresses, stop at the first
+        # header containing the list (usually To, so Cc/Bcc are never parsed)
+        for header in ('To', 'Cc', 'Bcc'):
+            value = mail.get(header)
+            # only parse headers which mention the list address at all
+            if (value is not None and
+                    self._mail_addr_lower in str(value).lower() and
+                    any(addr.lower() == self._mail_addr_lower
+                        for addr in self._extract_mail_addrs(value))):
+                return True
+        return False
 
     @assert_managing_subscriptions
     def subscribe(self, addr):
@@ -333,65 +655,83 @@ class Manager:
         self.sender.send(self.mail_addr, addr, mail)
 
     @assert_is_subscriber
-    def forward(self, addr, mail, exclude=set()):
-        logging.info('Forward %s', self._desc_mail(mail))
+    def forward(self, addr, mail, exclude=None, body=None):
+        """Forward mail to the list.
+
+        If body is given, mail only holds the headers and the raw body bytes
+        are appended without parsing and re-encoding them.
+        """
+        exclude = frozenset(exclude or ())
+        logging.info('Forward %s', _LazyStr(self._desc_mail, mail))
         self._clean_mail(mail)
-        mail.add_header('List-Post', '<mailto:%s>' % self.mail_addr)
-        subject = mail.get('Subject')
-        if subject is None:
-            mail.add_header('Subject', '%s (empty subject)'
-                                        % self.subject_prefix)
+        if body is not None:
+            mail = _serialize_mail(mail) + body
+        recipients = list(self.storage.get_subscribers(exclude=exclude))
+        self.sender.send_many(self.mail_addr, recipients, mail)
+
+    def _dispatch(self, mail_id, mail):
+        """Act on a mail which has been sent to the list."""
+        sender = self._get_sender(mail)
+        subject = mail.get('Subject', '').strip()
+        command = self.COMMANDS.get(subject.lower())
+        if command is not None:
+            getattr(self, command)(sender)
+        elif (match := self.ACTION_REGEX.search(subject)):
+            action, key = match.groups()
+            if action == 'verify':
+                self.verify(sender, key)
+            else:
+                self.unsubscribe(sender, key)
         else:
-            subject_match = self.CLEAN_SUBJECT_REGEX.search(subject)
-            if subject_match:
-                clean_subject = subject_match.group(1)
-                if not clean_subject.strip().startswith(self.subject_prefix):
-                    mail.replace_header('Subject', '%s %s'
-                                        % (self.subject_prefix, clean_subject))
-        for subscriber in self.storage.get_subscribers():
-            if subscriber not in exclude:
-                self.sender.send(self.mail_addr, subscriber, mail)
+            # forward rejects non-subscribers as well, but checking first
+            # spares downloading the full mail (mostly spam) for nothing
+            if not self.storage.is_subscribed(sender):
+                raise UserError('Blocked forward %s: E-Mail is not a '
+                                'subscriber' % self._desc_mail(mail))
+            exclude = frozenset([sender] if self.skip_sender else [])
+            mail, body = self.inbox.fetch_full(mail_id)
+            self.forward(sender, mail, exclude=exclude, body=body)
 
     def process(self):
-        with self.inbox, self.sender:
-            for mail_id, mail in self.inbox.fetch_all():
-                try:
-                    sender = self._get_sender(mail)
-                    subject = mail.get('Subject', '').strip()
-                    if not self.is_directed_at_list(mail):
-                        pass
-                    elif subject.lower() == 'subscribe':
-                        self.subscribe(sender)
-                    elif subject.lower() == 'unsubscribe':
-                        self.send_deletion_key(sender)
-                    elif self.VERIFY_REGEX.search(subject):
-                        match = self.VERIFY_REGEX.search(subject)
-                        self.verify(sender, match.group(1))
-                    elif self.UNSUBSCRIBE_REGEX.search(subject):
-                        match = self.UNSUBSCRIBE_REGEX.search(subject)
-                        self.unsubscribe(sender, match.group(1))
-                    else:
-                        exclude = [sender] if self.skip_sender else []
-                        self.forward(sender, mail, exclude=exclude)
-                    self.inbox.delete(mail_id)
-                except UserError as error:
-                    logging.warning(str(error))
-                    self.inbox.delete(mail_id)
-                except:
-                    logging.exception('Exception while processing %s',
-                                      self._desc_mail(mail))
+        processed = []
+        with self.inbox:
+            try:
+                for mail_id, mail in self.inbox.fetch_all(headers_only=True):
+                    try:
+                        # mails which are not for the list are simply dropped
+                        if self.is_directed_at_list(mail):
+                            self._dispatch(mail_id, mail)
+                        processed.append(mail_id)
+                    except UserError as error:
+                        logging.warning(str(error))
+                        processed.append(mail_id)
+                    except Exception:
+                        # not SystemExit, so that SIGTERM stops the daemon
+                        logging.exception('Exception while processing %s',
+                                          _LazyStr(self._desc_mail, mail))
+            finally:
+                # delete all processed mails in one go
+                if processed:
+                    self.inbox.delete_many(processed)
 
 
 def main(interval, manager):
     try:
         logging.debug('Starting...')
-        while True:
-            manager.process()
-            time.sleep(interval)
+        # connections are kept open across polls
+        with contextlib.closing(manager.inbox), manager.sender:
+            while True:
+                manager.process()
+                time.sleep(interval)
     except KeyboardInterrupt:
         pass
 
 
+def _terminate(signum, frame):
+    """Exit through main() so that open connections are closed cleanly."""
+    raise SystemExit(0)
+
+
 def _parse_cmdline():
     parser = argparse.ArgumentParser(description=__doc__)
     parser.add_argument('-s', '--settings', default='settings.py',
@@ -441,4 +781,5 @@ if __name__ == '__main__':
     args = _parse_cmdline()
     settings = _load_settings(args.settings)
     logging.config.dictConfig(settings['LOGGING'])
+    signal.signal(signal.SIGTERM, _terminate)
     main(settings['POLLING_INTERVAL'], settings['MANAGER'])
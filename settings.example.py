@@ -23,7 +23,8 @@ inbox = IMAPInbox(
     password='test',        # IMAP password
     inbox='INBOX',          # name of the inbox folder (e.g. INBOX)
     ssl=True,               # use SSL/TLS?
-    startssl=False          # use STARTSSL? (if ssl=True, this will be ignored)
+    startssl=False,         # use STARTSSL? (if ssl=True, this will be ignored)
+    batch_size=100          # how many mails to download per FETCH command
 )
 
 
@@ -35,7 +36,9 @@ sender = SMTPSender(
     username='test',        # SMTP username
     password='test',        # SMTP password
     ssl=True,               # use SSL/TLS?
-    startssl=False          # use STARTSSL? (if ssl=True, this will be ignored)
+    startssl=False,         # use STARTSSL? (if ssl=True, this will be ignored)
+    connections=1,          # parallel connections used to deliver list mail
+    max_recipients=100      # recipients per mail (servers may reject more)
 )
 
 
@@ -1,20 +1,70 @@
 #!/usr/bin/env python3
+import copy
+import email
 import email.mime.text
 import ezlist
+import imaplib
+import logging
+import signal
+import smtplib
+import sqlite3
+import time
 import unittest
 import unittest.mock as mock
 
 
+_MAIL_TEMPLATE = email.mime.text.MIMEText('Test Text')
+
+
 def _build_mail(subject='Test Subject', from_='sender@test.com',
                 to='recipient@test.com', text='Test Text'):
-    mail = email.mime.text.MIMEText(text)
-    mail['Subject'] = subject
-    mail['From'] = from_
-    mail['To'] = to
+    if text != _MAIL_TEMPLATE.get_payload():
+        mail = email.mime.text.MIMEText(text)
+        mail['Subject'] = subject
+        mail['From'] = from_
+        mail['To'] = to
+        return mail
+    # shallow copy, but the headers must not be shared with the template.
+    # MIMEText uses the compat32 policy, which stores header values as they
+    # are, so they can be appended without going through __setitem__.
+    mail = copy.copy(_MAIL_TEMPLATE)
+    mail._headers = _MAIL_TEMPLATE._headers + [
+        ('Subject', subject), ('From', from_), ('To', to)]
     return mail
 
 
+def _patch_for_class(cls, target, **kwargs):
+    """Patch target until all tests of cls ran, instead of once per test."""
+    patcher = mock.patch(target, **kwargs)
+    cls.addClassCleanup(patcher.stop)
+    return patcher.start()
+
+
+def _reset_mocks(*mocks):
+    for patched in mocks:
+        patched.reset_mock(return_value=True, side_effect=True)
+
+
+def _recipients(send):
+    """Collect the recipients of all calls to a mocked send method."""
+    addrs = []
+    for call in send.call_args_list:
+        to = call.args[1]
+        addrs.extend([to] if isinstance(to, str) else to)
+    return addrs
+
+
 class IMAPInboxTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.imap = _patch_for_class(cls, 'imaplib.IMAP4',
+                                    error=imaplib.IMAP4.error,
+                                    abort=imaplib.IMAP4.abort)
+        cls.imap_ssl = _patch_for_class(cls, 'imaplib.IMAP4_SSL')
+
+    def setUp(self):
+        _reset_mocks(self.imap, self.imap_ssl)
+
     def build_inbox(self, **kwargs):
         options = {
             'host': 'localhost',
@@ -23,46 +73,142 @@ class IMAPInboxTest(unittest.TestCase):
             'password': 'test',
             'inbox': 'INBOX',
             'ssl': False,
-            'startssl': False
+            'startssl': False,
+            'batch_size': 100
         }
         options.update(kwargs)
         return ezlist.IMAPInbox(**options)
 
-    @mock.patch('imaplib.IMAP4')
-    def test_connect(self, imap):
+    def test_connect(self):
         inbox = self.build_inbox()
-        imap.assert_not_called()
+        self.imap.assert_not_called()
         with inbox:
-            imap.assert_called_once_with('localhost', 7357)
-        imap.return_value.close.assert_called_once_with()
+            self.imap.assert_called_once_with('localhost', 7357)
+        self.imap.return_value.expunge.assert_called_once_with()
 
-    @mock.patch('imaplib.IMAP4_SSL')
-    def test_connect_ssl(self, imap_ssl):
+    def test_connect_ssl(self):
         inbox = self.build_inbox(ssl=True)
-        imap_ssl.assert_not_called()
+        self.imap_ssl.assert_not_called()
         with inbox:
-            imap_ssl.assert_called_once_with('localhost', 7357)
-        imap_ssl.return_value.close.assert_called_once_with()
+            self.imap_ssl.assert_called_once_with('localhost', 7357)
+        self.imap_ssl.return_value.expunge.assert_called_once_with()
 
-    @mock.patch('imaplib.IMAP4')
-    def test_connect_startssl(self, imap):
+    def test_connect_startssl(self):
         inbox = self.build_inbox(startssl=True)
-        imap.assert_not_called()
+        self.imap.assert_not_called()
         with inbox:
-            imap.assert_called_once_with('localhost', 7357)
-            imap.return_value.starttls.assert_called_once_with()
-        imap.return_value.close.assert_called_once_with()
+            self.imap.assert_called_once_with('localhost', 7357)
+            self.imap.return_value.starttls.assert_called_once_with()
+        self.imap.return_value.expunge.assert_called_once_with()
 
-    @mock.patch('imaplib.IMAP4_SSL')
-    def test_connect_ssl_over_startssl(self, imap_ssl):
+    def test_connect_ssl_over_startssl(self):
         inbox = self.build_inbox(ssl=True, startssl=True)
-        imap_ssl.assert_not_called()
+        self.imap_ssl.assert_not_called()
         with inbox:
-            imap_ssl.assert_called_once_with('localhost', 7357)
-        imap_ssl.return_value.close.assert_called_once_with()
+            self.imap_ssl.assert_called_once_with('localhost', 7357)
+        self.imap_ssl.return_value.expunge.assert_called_once_with()
+
+    def test_reuse_connection(self):
+        self.imap.return_value.noop.return_value = ('OK', [b''])
+        inbox = self.build_inbox()
+        with inbox:
+            pass
+        with inbox:
+            self.imap.return_value.noop.assert_called_once_with()
+        self.assertEqual(1, self.imap.call_count)
+        self.imap.return_value.close.assert_not_called()
+        inbox.close()
+        self.imap.return_value.close.assert_called_once_with()
+        self.imap.return_value.logout.assert_called_once_with()
+
+    def test_reconnect(self):
+        self.imap.return_value.noop.side_effect = self.imap.abort(
+            'connection lost')
+        inbox = self.build_inbox()
+        with inbox:
+            pass
+        with inbox:
+            pass
+        self.assertEqual(2, self.imap.call_count)
+
+    def test_fetch_all(self):
+        self.imap.return_value.search.return_value = ('OK', [b'1 2'])
+        self.imap.return_value.fetch.return_value = ('OK', [
+            (b'1 (BODY[] {10}', _build_mail(subject='one').as_bytes()), b')',
+            (b'2 (BODY[] {10}', _build_mail(subject='two').as_bytes()), b')',
+        ])
+        with self.build_inbox() as inbox:
+            mails = list(inbox.fetch_all())
+        self.imap.return_value.fetch.assert_called_once_with(
+            '1,2', '(BODY.PEEK[])')
+        self.assertEqual(['1', '2'], [mail_id for mail_id, _ in mails])
+        self.assertEqual(['one', 'two'],
+                         [mail['Subject'] for _, mail in mails])
+
+    def test_fetch_all_batches(self):
+        self.imap.return_value.search.return_value = ('OK', [b'1 2 3'])
+        self.imap.return_value.fetch.return_value = ('OK', [])
+        with self.build_inbox(batch_size=2) as inbox:
+            list(inbox.fetch_all())
+        self.imap.return_value.fetch.assert_has_calls([
+            mock.call('1,2', '(BODY.PEEK[])'),
+            mock.call('3', '(BODY.PEEK[])'),
+        ])
+
+    def test_fetch_all_headers_only(self):
+        self.imap.return_value.search.return_value = ('OK', [b'1'])
+        self.imap.return_value.fetch.return_value = ('OK', [
+            (b'1 (BODY[HEADER.FIELDS (SUBJECT)] {10}', b'Subject: one\r\n'),
+            b')',
+        ])
+        with self.build_inbox() as inbox:
+            mails = list(inbox.fetch_all(headers_only=True))
+        self.imap.return_value.fetch.assert_called_once_with(
+            '1', ezlist.IMAPInbox.DISPATCH_HEADERS)
+        self.assertEqual('one', mails[0][1]['Subject'])
+
+    def test_fetch_full(self):
+        self.imap.return_value.fetch.return_value = ('OK', [
+            (b'1 (BODY[] {10}', _build_mail(subject='one').as_bytes()), b')',
+        ])
+        with self.build_inbox() as inbox:
+            mail, body = inbox.fetch_full('1')
+        self.imap.return_value.fetch.assert_called_once_with(
+            '1', '(BODY.PEEK[])')
+        self.assertEqual('one', mail['Subject'])
+        self.assertEqual(b'Test Text', body)
+
+    def test_delete_many(self):
+        with self.build_inbox() as inbox:
+            inbox.delete_many(['1', '2', '5'])
+        self.imap.return_value.store.assert_called_once_with(
+            '1,2,5', '+FLAGS.SILENT', '\\Deleted')
+
+    def test_delete_on_exit(self):
+        with self.build_inbox() as inbox:
+            inbox.delete('1')
+            inbox.delete('3')
+            self.imap.return_value.store.assert_not_called()
+        self.imap.return_value.store.assert_called_once_with(
+            '1,3', '+FLAGS.SILENT', '\\Deleted')
+        self.imap.return_value.expunge.assert_called_once_with()
+
+    def test_fetch_all_empty(self):
+        self.imap.return_value.search.return_value = ('OK', [b''])
+        with self.build_inbox() as inbox:
+            self.assertEqual([], list(inbox.fetch_all()))
+        self.imap.return_value.fetch.assert_not_called()
 
 
 class SMTPInboxTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.smtp = _patch_for_class(cls, 'smtplib.SMTP')
+        cls.smtp_ssl = _patch_for_class(cls, 'smtplib.SMTP_SSL')
+
+    def setUp(self):
+        _reset_mocks(self.smtp, self.smtp_ssl)
+
     def build_sender(self, **kwargs):
         options = {
             'host': 'localhost',
@@ -71,51 +217,129 @@ class SMTPInboxTest(unittest.TestCase):
             'username': 'test',
             'password': 'test',
             'ssl': False,
-            'startssl': False
+            'startssl': False,
+            'connections': 1,
+            'max_recipients': 100
         }
         options.update(kwargs)
         return ezlist.SMTPSender(**options)
 
-    @mock.patch('smtplib.SMTP')
-    def test_connect(self, smtp):
+    def test_connect(self):
         sender = self.build_sender()
-        smtp.assert_not_called()
+        self.smtp.assert_not_called()
         with sender:
-            smtp.assert_not_called()  # lazy connect
+            self.smtp.assert_not_called()  # lazy connect
             sender.send('sender@test.com', 'recipient@test.com', _build_mail())
-            smtp.assert_called_once_with('localhost', 7357, 'test.de')
-        smtp.return_value.quit.assert_called_once_with()
+            self.smtp.assert_called_once_with('localhost', 7357, 'test.de')
+        self.smtp.return_value.quit.assert_called_once_with()
 
-    @mock.patch('smtplib.SMTP_SSL')
-    def test_connect_ssl(self, smtp_ssl):
+    def test_connect_ssl(self):
         sender = self.build_sender(ssl=True)
-        smtp_ssl.assert_not_called()
+        self.smtp_ssl.assert_not_called()
         with sender:
-            smtp_ssl.assert_not_called()  # lazy connect
+            self.smtp_ssl.assert_not_called()  # lazy connect
             sender.send('sender@test.com', 'recipient@test.com', _build_mail())
-            smtp_ssl.assert_called_once_with('localhost', 7357, 'test.de')
-        smtp_ssl.return_value.quit.assert_called_once_with()
+            self.smtp_ssl.assert_called_once_with('localhost', 7357, 'test.de')
+        self.smtp_ssl.return_value.quit.assert_called_once_with()
 
-    @mock.patch('smtplib.SMTP')
-    def test_connect_startssl(self, smtp):
+    def test_connect_startssl(self):
         sender = self.build_sender(startssl=True)
-        smtp.assert_not_called()
+        self.smtp.assert_not_called()
         with sender:
-            smtp.assert_not_called()  # lazy connect
+            self.smtp.assert_not_called()  # lazy connect
             sender.send('sender@test.com', 'recipient@test.com', _build_mail())
-            smtp.assert_called_once_with('localhost', 7357, 'test.de')
-            smtp.return_value.starttls.assert_called_once_with()
-        smtp.return_value.quit.assert_called_once_with()
+            self.smtp.assert_called_once_with('localhost', 7357, 'test.de')
+            self.smtp.return_value.starttls.assert_called_once_with()
+        self.smtp.return_value.quit.assert_called_once_with()
 
-    @mock.patch('smtplib.SMTP_SSL')
-    def test_connect_ssl_over_startssl(self, smtp_ssl):
+    def test_connect_ssl_over_startssl(self):
         sender = self.build_sender(ssl=True, startssl=True)
-        smtp_ssl.assert_not_called()
+        self.smtp_ssl.assert_not_called()
         with sender:
-            smtp_ssl.assert_not_called()  # lazy connect
+            self.smtp_ssl.assert_not_called()  # lazy connect
             sender.send('sender@test.com', 'recipient@test.com', _build_mail())
-            smtp_ssl.assert_called_once_with('localhost', 7357, 'test.de')
-        smtp_ssl.return_value.quit.assert_called_once_with()
+            self.smtp_ssl.assert_called_once_with('localhost', 7357, 'test.de')
+        self.smtp_ssl.return_value.quit.assert_called_once_with()
+
+    def test_reconnect_after_idle(self):
+        sender = self.build_sender()
+        with sender:
+            sender.send('sender@test.com', 'recipient@test.com', _build_mail())
+            # a recent connection is reused without checking
+            sender.send('sender@test.com', 'recipient@test.com', _build_mail())
+            self.smtp.return_value.noop.assert_not_called()
+            self.assertEqual(1, self.smtp.call_count)
+            idle = time.monotonic() + sender.KEEPALIVE_INTERVAL + 1
+            self.smtp.return_value.noop.side_effect = (
+                smtplib.SMTPServerDisconnected)
+            with mock.patch('time.monotonic', return_value=idle):
+                sender.send('sender@test.com', 'recipient@test.com',
+                            _build_mail())
+            self.smtp.return_value.noop.assert_called_once_with()
+            self.assertEqual(2, self.smtp.call_count)
+
+    def test_send_many(self):
+        recipients = ['recipient@test.com', 'recipient2@test.com']
+        mail = _build_mail()
+        with self.build_sender() as sender:
+            sender.send_many('sender@test.com', recipients, mail)
+        self.smtp.return_value.sendmail.assert_called_once_with(
+            'sender@test.com', recipients, mock.ANY, [])
+        payload = self.smtp.return_value.sendmail.call_args[0][2]
+        self.assertEqual(mail.as_string().replace('\n', '\r\n').encode(),
+                         payload)
+
+    def test_send_bytes(self):
+        with self.build_sender() as sender:
+            sender.send('sender@test.com', 'recipient@test.com', b'raw mail')
+        self.smtp.return_value.sendmail.assert_called_once_with(
+            'sender@test.com', 'recipient@test.com', b'raw mail', [])
+
+    def test_send_8bit(self):
+        self.smtp.return_value.has_extn.return_value = True
+        mail = email.message_from_bytes(
+            b'Content-Transfer-Encoding: 8bit\n\nGr\xc3\xbc\xc3\x9fe')
+        with self.build_sender() as sender:
+            sender.send('sender@test.com', 'recipient@test.com', mail)
+        self.smtp.return_value.has_extn.assert_called_once_with('8bitmime')
+        self.assertEqual(['BODY=8BITMIME'],
+                         self.smtp.return_value.sendmail.call_args[0][3])
+
+    def test_send_many_max_recipients(self):
+        recipients = ['a@test.com', 'b@test.com', 'c@test.com']
+        with self.build_sender(max_recipients=2) as sender:
+            sender.send_many('sender@test.com', recipients, _build_mail())
+        self.assertEqual(1, self.smtp.call_count)
+        self.smtp.return_value.sendmail.assert_has_calls([
+            mock.call('sender@test.com', recipients[:2], mock.ANY, []),
+            mock.call('sender@test.com', recipients[2:], mock.ANY, []),
+        ])
+
+    def test_send_many_parallel(self):
+        recipients = ['a@test.com', 'b@test.com', 'c@test.com']
+        with self.build_sender(max_recipients=1, connections=2) as sender:
+            sender.send_many('sender@test.com', recipients, _build_mail())
+        # two connections share the three transactions
+        self.assertEqual(2, self.smtp.call_count)
+        self.assertEqual(3, self.smtp.return_value.sendmail.call_count)
+        sent_to = [call[0][1] for call in
+                   self.smtp.return_value.sendmail.call_args_list]
+        self.assertCountEqual([[addr] for addr in recipients], sent_to)
+        self.assertEqual(2, self.smtp.return_value.quit.call_count)
+
+    def test_send_many_without_recipients_after_pool_use(self):
+        recipients = ['a@test.com', 'b@test.com']
+        with self.build_sender(max_recipients=1, connections=2) as sender:
+            sender.send_many('sender@test.com', recipients, _build_mail())
+            with mock.patch('concurrent.futures.ThreadPoolExecutor') as pool:
+                sender.send_many('sender@test.com', [], _build_mail())
+            pool.assert_not_called()
+        self.assertEqual(2, self.smtp.return_value.sendmail.call_count)
+
+    def test_send_many_without_recipients(self):
+        with self.build_sender() as sender:
+            sender.send_many('sender@test.com', [], _build_mail())
+        self.smtp.assert_not_called()
 
 
 class SQLiteStorageTest(unittest.TestCase):
@@ -139,6 +363,14 @@ class SQLiteStorageTest(unittest.TestCase):
         self.storage.delete_unverified(self.EMAIL)
         self.assertFalse(self.storage.is_unverified(self.EMAIL, self.KEY))
 
+    def test_purge_unverified(self):
+        self.storage.add_unverified(self.EMAIL, self.KEY)
+        self.storage.add_unverified(self.EMAIL2, self.KEY2)
+        self.storage.purge_unverified([(self.EMAIL, self.KEY),
+                                       (self.EMAIL2, 'otherkey')])
+        self.assertFalse(self.storage.is_unverified(self.EMAIL, self.KEY))
+        self.assertTrue(self.storage.is_unverified(self.EMAIL2, self.KEY2))
+
     def test_add_subscriber(self):
         self.storage.add_subscriber(self.EMAIL, self.KEY)
         self.assertTrue(self.storage.is_subscribed(self.EMAIL))
@@ -153,16 +385,133 @@ class SQLiteStorageTest(unittest.TestCase):
         self.assertFalse(self.storage.is_subscribed(self.EMAIL))
         self.assertFalse(self.storage.is_subscribed(self.EMAIL, self.KEY))
 
+    def test_add_subscribers(self):
+        self.assertFalse(self.storage.is_subscribed(self.EMAIL))
+        self.storage.add_subscribers([(self.EMAIL, self.KEY),
+                                      (self.EMAIL2, self.KEY2)])
+        self.assertTrue(self.storage.is_subscribed(self.EMAIL, self.KEY))
+        self.assertTrue(self.storage.is_subscribed(self.EMAIL2, self.KEY2))
+        self.assertEqual(self.KEY2, self.storage.get_deletion_key(self.EMAIL2))
+
+    def test_add_subscribers_duplicate(self):
+        self.storage.add_subscriber(self.EMAIL2, self.KEY2)
+        with self.assertRaises(sqlite3.IntegrityError):
+            self.storage.add_subscribers([(self.EMAIL, self.KEY),
+                                          (self.EMAIL2, self.KEY2)])
+        self.assertFalse(self.storage.is_subscribed(self.EMAIL))
+        # a later commit must not carry the failed batch along
+        self.storage.add_unverified(self.EMAIL, self.KEY)
+        self.assertEqual([], self.storage._select(
+            'SELECT 1 FROM subscribers WHERE email=?', self.EMAIL))
+
+    def test_bulk_load(self):
+        self.storage.add_subscriber(self.EMAIL, self.KEY)
+        self.storage.bulk_load([(self.EMAIL2, self.KEY2)])
+        self.assertTrue(self.storage.is_subscribed(self.EMAIL2, self.KEY2))
+        self.assertCountEqual([self.EMAIL, self.EMAIL2],
+                              self.storage.get_subscribers())
+        # the unique index is back in place
+        with self.assertRaises(sqlite3.IntegrityError):
+            self.storage.add_subscriber(self.EMAIL2, self.KEY2)
+
+    def test_bulk_load_duplicate(self):
+        self.storage.add_subscriber(self.EMAIL, self.KEY)
+        with self.assertRaises(sqlite3.IntegrityError):
+            self.storage.bulk_load([(self.EMAIL2, self.KEY2),
+                                    (self.EMAIL, self.KEY)])
+        self.assertFalse(self.storage.is_subscribed(self.EMAIL2))
+        self.storage.add_subscriber(self.EMAIL2, self.KEY2)
+        with self.assertRaises(sqlite3.IntegrityError):
+            self.storage.add_subscriber(self.EMAIL2, self.KEY2)
+
     def test_get_subscribers(self):
         self.assertEqual([], list(self.storage.get_subscribers()))
         self.storage.add_subscriber(self.EMAIL, self.KEY)
         self.assertEqual([self.EMAIL], list(self.storage.get_subscribers()))
         self.storage.add_subscriber(self.EMAIL2, self.KEY2)
-        self.assertEqual([self.EMAIL, self.EMAIL2],
-                         list(self.storage.get_subscribers()))
+        # no particular order is promised
+        self.assertCountEqual([self.EMAIL, self.EMAIL2],
+                              self.storage.get_subscribers())
         self.storage.delete_subscriber(self.EMAIL)
         self.assertEqual([self.EMAIL2], list(self.storage.get_subscribers()))
 
+    def test_get_subscribers_exclude(self):
+        self.storage.add_subscribers([(self.EMAIL, self.KEY),
+                                      (self.EMAIL2, self.KEY2)])
+        self.assertEqual([self.EMAIL2], list(self.storage.get_subscribers(
+            exclude=[self.EMAIL, 'xy@test.com'])))
+
+    def test_change_subscribers_while_iterating(self):
+        self.storage.add_subscribers([(self.EMAIL, self.KEY),
+                                      (self.EMAIL2, self.KEY2)])
+        for addr in self.storage.get_subscribers():
+            self.storage.delete_subscriber(addr)
+        self.assertEqual([], list(self.storage.get_subscribers()))
+
+    def test_get_subscribers_cached(self):
+        self.storage.add_subscriber(self.EMAIL, self.KEY)
+        list(self.storage.get_subscribers())
+        with mock.patch.object(self.storage, '_select_iter') as select:
+            for _ in range(3):
+                self.assertEqual([self.EMAIL],
+                                 list(self.storage.get_subscribers()))
+            self.assertTrue(self.storage.is_subscribed(self.EMAIL))
+            select.assert_not_called()
+
+    def test_subscriber_cache_expires(self):
+        self.assertFalse(self.storage.is_subscribed(self.EMAIL))
+        # bypass the cache to simulate a change made by another process
+        self.storage._execute('INSERT INTO subscribers (email, deletion_key) '
+                              'VALUES (?, ?)', (self.EMAIL, self.KEY))
+        self.assertFalse(self.storage.is_subscribed(self.EMAIL))
+        expired = time.monotonic() + self.storage.CACHE_TTL + 1
+        with mock.patch('time.monotonic', return_value=expired):
+            self.assertTrue(self.storage.is_subscribed(self.EMAIL, self.KEY))
+
+
+class DictStorage:
+    """In-memory stand-in for SQLiteStorage used by the manager tests."""
+    def __init__(self):
+        self.unverified = set()
+        self.subscribers = {}
+
+    def is_unverified(self, addr, activation_key):
+        return (addr, activation_key) in self.unverified
+
+    def add_unverified(self, addr, activation_key):
+        self.unverified.add((addr, activation_key))
+
+    def delete_unverified(self, addr):
+        self.unverified = {pair for pair in self.unverified
+                           if pair[0] != addr}
+
+    def purge_unverified(self, pairs):
+        self.unverified.difference_update(pairs)
+
+    def is_subscribed(self, addr, deletion_key=''):
+        if addr not in self.subscribers:
+            return False
+        return not deletion_key or self.subscribers[addr] == deletion_key
+
+    def add_subscriber(self, addr, deletion_key):
+        self.subscribers[addr] = deletion_key
+
+    def add_subscribers(self, pairs):
+        self.subscribers.update(pairs)
+
+    bulk_load = add_subscribers
+
+    def get_deletion_key(self, addr):
+        return self.subscribers[addr]
+
+    def delete_subscriber(self, addr):
+        self.subscribers.pop(addr, None)
+
+    def get_subscribers(self, exclude=()):
+        exclude = frozenset(exclude)
+        return iter([addr for addr in self.subscribers
+                     if addr not in exclude])
+
 
 class ManagerTest(unittest.TestCase):
     EMAIL = 'foo@bar.com'
@@ -175,9 +524,9 @@ class ManagerTest(unittest.TestCase):
     def build_manager(self, **kwargs):
         options = {
             'mail_addr': self.LIST_EMAIL,
-            'inbox': mock.MagicMock(),
-            'sender': mock.MagicMock(),
-            'storage': ezlist.SQLiteStorage(':memory:'),
+            'inbox': mock.MagicMock(spec=ezlist.IMAPInbox),
+            'sender': mock.MagicMock(spec=ezlist.SMTPSender),
+            'storage': DictStorage(),
             'subject_prefix': self.SUBJECT_PREFIX,
             'skip_sender': True,
             'manage_subscriptions': True
@@ -185,6 +534,11 @@ class ManagerTest(unittest.TestCase):
         options.update(kwargs)
         return ezlist.Manager(**options)
 
+    def test_dict_storage_api(self):
+        public = {name for name in vars(ezlist.SQLiteStorage)
+                  if not name.startswith('_') and not name.isupper()}
+        self.assertLessEqual(public, set(vars(DictStorage)))
+
     def test_is_directed_at_list(self):
         manager = self.build_manager()
         mail = _build_mail(to=self.LIST_EMAIL)
@@ -199,19 +553,44 @@ class ManagerTest(unittest.TestCase):
         mail = _build_mail(to=self.EMAIL)
         mail.add_header('Bcc', self.LIST_EMAIL)
         self.assertTrue(manager.is_directed_at_list(mail))
+        mail = _build_mail(to=self.LIST_EMAIL.upper())
+        self.assertTrue(manager.is_directed_at_list(mail))
+        mail = _build_mail(to='"%s" <%s>' % (self.LIST_EMAIL, self.EMAIL))
+        self.assertFalse(manager.is_directed_at_list(mail))
+        mail = _build_mail(to='"Doe, John" <%s>, List <%s>'
+                              % (self.EMAIL, self.LIST_EMAIL))
+        self.assertTrue(manager.is_directed_at_list(mail))
+
+    def test_is_directed_at_list_skips_unrelated_headers(self):
+        manager = self.build_manager()
+        mail = _build_mail(to=self.EMAIL)
+        mail.add_header('Cc', self.LIST_EMAIL)
+        with mock.patch('ezlist._parse_mail_addrs',
+                        wraps=ezlist._parse_mail_addrs) as parse:
+            self.assertTrue(manager.is_directed_at_list(mail))
+        parse.assert_called_once_with(self.LIST_EMAIL)
 
     def test_subscribe(self):
         manager = self.build_manager()
         key = manager.subscribe(self.EMAIL)
         self.assertTrue(len(key) > 12)
+        self.assertRegex(key, r'^[A-Za-z0-9_-]+$')
         self.assertTrue(manager.storage.is_unverified(self.EMAIL, key))
         self.assertTrue(manager.sender.send.called)
-        mail = manager.sender.send.call_args[0][2]
+        mail = email.message_from_bytes(manager.sender.send.call_args[0][2])
         self.assertTrue(mail['Subject'].startswith(self.SUBJECT_PREFIX))
         self.assertTrue(key in mail['Subject'])
         self.assertTrue(self.EMAIL in mail['To'])
         self.assertTrue(self.LIST_EMAIL in mail['From'])
 
+    def test_subscribe_non_ascii(self):
+        manager = self.build_manager(default_language='tr')
+        key = manager.subscribe(self.EMAIL)
+        mail = manager.sender.send.call_args[0][2]
+        self.assertIsInstance(mail, email.message.Message)
+        self.assertTrue(key in mail['Subject'])
+        self.assertEqual('utf-8', mail.get_content_charset())
+
     def test_subscribe_already_subscribed(self):
         manager = self.build_manager()
         manager.storage.add_subscriber(self.EMAIL, self.KEY)
@@ -252,7 +631,7 @@ class ManagerTest(unittest.TestCase):
         manager.storage.add_subscriber(self.EMAIL, self.KEY)
         manager.send_deletion_key(self.EMAIL)
         self.assertTrue(manager.sender.send.called)
-        mail = manager.sender.send.call_args[0][2]
+        mail = email.message_from_bytes(manager.sender.send.call_args[0][2])
         self.assertTrue(self.KEY in mail['Subject'])
 
     def test_send_deletion_key_not_subscribed(self):
@@ -286,14 +665,14 @@ class ManagerTest(unittest.TestCase):
 
     def test_forward(self):
         manager = self.build_manager()
-        manager.storage.add_subscriber(self.EMAIL, self.KEY)
-        manager.storage.add_subscriber(self.EMAIL2, self.KEY2)
+        manager.storage.add_subscribers([(self.EMAIL, self.KEY),
+                                         (self.EMAIL2, self.KEY2)])
         mail = _build_mail(to=self.LIST_EMAIL)
         manager.forward(self.EMAIL, mail)
-        self.assertEqual(2, manager.sender.send.call_count)
+        self.assertEqual(1, manager.sender.send_many.call_count)
         # have all subscribers been notified?
-        addrs = set(call[0][1] for call in manager.sender.send.call_args_list)
-        self.assertEqual({self.EMAIL, self.EMAIL2}, addrs)
+        self.assertCountEqual([self.EMAIL, self.EMAIL2],
+                              _recipients(manager.sender.send_many))
 
     def test_forward_headers(self):
         manager = self.build_manager()
@@ -303,21 +682,37 @@ class ManagerTest(unittest.TestCase):
         msgid = '<56EFCAED.3060009@test.de>'
         mail.add_header('Reply-To', self.EMAIL)
         mail.add_header('X-Custom-Header', 'test')
+        mail.add_header('message-id', msgid)
         manager.forward(self.EMAIL, mail)
-        mail = manager.sender.send.call_args[0][2]
+        mail = manager.sender.send_many.call_args[0][2]
+        self.assertEqual(msgid, mail['Message-ID'])
         self.assertTrue(self.LIST_EMAIL in mail['List-Post'])
         self.assertEqual(self.EMAIL, mail['Reply-To'])
         self.assertEqual('test', mail['Date'])
         self.assertFalse('X-Custom-Header' in mail)
 
-    def test_forward_exclude(self):
+    def test_forward_raw_body(self):
         manager = self.build_manager()
         manager.storage.add_subscriber(self.EMAIL, self.KEY)
-        manager.storage.add_subscriber(self.EMAIL2, self.KEY2)
+        mail = _build_mail(to=self.LIST_EMAIL, subject='Test', text='')
+        mail.add_header('X-Custom-Header', 'test')
+        body = b'Gr\xc3\xbc\xc3\x9fe\r\n'
+        manager.forward(self.EMAIL, mail, body=body)
+        payload = manager.sender.send_many.call_args[0][2]
+        headers, sent_body = payload.split(b'\r\n\r\n', 1)
+        self.assertEqual(body, sent_body)
+        self.assertIn(b'Subject: %s Test' % self.SUBJECT_PREFIX.encode(),
+                      headers)
+        self.assertNotIn(b'X-Custom-Header', headers)
+
+    def test_forward_exclude(self):
+        manager = self.build_manager()
+        manager.storage.add_subscribers([(self.EMAIL, self.KEY),
+                                         (self.EMAIL2, self.KEY2)])
         manager.forward(self.EMAIL, _build_mail(to=self.LIST_EMAIL),
                         exclude=[self.EMAIL])
-        self.assertEqual(1, manager.sender.send.call_count)
-        self.assertEqual(self.EMAIL2, manager.sender.send.call_args[0][1])
+        self.assertEqual(1, manager.sender.send_many.call_count)
+        self.assertEqual([self.EMAIL2], _recipients(manager.sender.send_many))
 
     def test_forward_list_prefix(self):
         manager = self.build_manager()
@@ -325,106 +720,173 @@ class ManagerTest(unittest.TestCase):
 
         mail = _build_mail(to=self.LIST_EMAIL, subject='Test')
         manager.forward(self.EMAIL, mail)
-        mail = manager.sender.send.call_args[0][2]
+        mail = manager.sender.send_many.call_args[0][2]
         self.assertEqual('%s Test' % self.SUBJECT_PREFIX, mail['Subject'])
 
         subject = 'Test %s' % self.SUBJECT_PREFIX
         mail = _build_mail(to=self.LIST_EMAIL, subject=subject)
         manager.forward(self.EMAIL, mail)
-        mail = manager.sender.send.call_args[0][2]
+        mail = manager.sender.send_many.call_args[0][2]
         self.assertEqual('%s %s' % (self.SUBJECT_PREFIX, subject),
                          mail['Subject'])
 
         subject = 'Re: Aw: Fwd: %s Test Prefix after Re:' % self.SUBJECT_PREFIX
         mail = _build_mail(to=self.LIST_EMAIL, subject=subject)
         manager.forward(self.EMAIL, mail)
-        mail = manager.sender.send.call_args[0][2]
+        mail = manager.sender.send_many.call_args[0][2]
         self.assertEqual(subject, mail['Subject'])
 
+        subject = '%s Already prefixed' % self.SUBJECT_PREFIX
+        mail = _build_mail(to=self.LIST_EMAIL, subject=subject)
+        manager.forward(self.EMAIL, mail)
+        mail = manager.sender.send_many.call_args[0][2]
+        self.assertEqual(subject, mail['Subject'])
+
+        mail = _build_mail(to=self.LIST_EMAIL, subject='Re: AW: Test')
+        manager.forward(self.EMAIL, mail)
+        mail = manager.sender.send_many.call_args[0][2]
+        self.assertEqual('%s Test' % self.SUBJECT_PREFIX, mail['Subject'])
+
+    def test_forward_log_is_lazy(self):
+        manager = self.build_manager()
+        manager.storage.add_subscriber(self.EMAIL, self.KEY)
+        manager._desc_mail = mock.MagicMock(return_value='<mail>')
+        with mock.patch('logging.root.level', logging.WARNING):
+            manager.forward(self.EMAIL, _build_mail(to=self.LIST_EMAIL))
+        manager._desc_mail.assert_not_called()
+        with self.assertLogs(level='INFO') as logs:
+            manager.forward(self.EMAIL, _build_mail(to=self.LIST_EMAIL))
+        self.assertEqual(['INFO:root:Forward <mail>'], logs.output)
+
     def test_forward_not_subscribed(self):
         manager = self.build_manager()
         with self.assertRaises(ezlist.UserError):
             manager.forward(self.EMAIL, _build_mail())
 
-    def test_process_subscribe(self):
+    def test_process_commands(self):
         manager = self.build_manager()
-        manager.inbox.fetch_all.return_value = (
-            (1, _build_mail(to='Maillist <%s>' % self.LIST_EMAIL,
-                            from_=self.EMAIL, subject='subscribe')),
-            (2, _build_mail(to=self.LIST_EMAIL, from_=self.EMAIL2,
-                            subject='   subscribe  ')),
+        cases = (
+            ('subscribe', (
+                ('Maillist <%s>' % self.LIST_EMAIL, self.EMAIL, 'subscribe'),
+                (self.LIST_EMAIL, self.EMAIL2, '   subscribe  '),
+            ), [mock.call(self.EMAIL), mock.call(self.EMAIL2)]),
+            ('send_deletion_key', (
+                (self.LIST_EMAIL, self.EMAIL, 'unsubscribe'),
+                (self.LIST_EMAIL, self.EMAIL2, '   unsubscribe  '),
+            ), [mock.call(self.EMAIL), mock.call(self.EMAIL2)]),
+            ('verify', (
+                (self.LIST_EMAIL, self.EMAIL,
+                 'Re: [Foolist] verify <%s>' % self.KEY),
+            ), [mock.call(self.EMAIL, self.KEY)]),
+            ('unsubscribe', (
+                (self.LIST_EMAIL, self.EMAIL, 'unsubscribe <%s>' % self.KEY),
+            ), [mock.call(self.EMAIL, self.KEY)]),
         )
-        manager.subscribe = mock.MagicMock()
-        manager.process()
-        self.assertEqual(2, manager.subscribe.call_count)
-        manager.subscribe.assert_has_calls([mock.call(self.EMAIL),
-                                            mock.call(self.EMAIL2)])
-        manager.inbox.delete.assert_has_calls([mock.call(1), mock.call(2)])
-
-    def test_process_unsubscribe_without_key(self):
+        for method, mails, calls in cases:
+            with self.subTest(method=method), \
+                    mock.patch.object(manager, method) as handler:
+                manager.inbox.reset_mock()
+                manager.inbox.fetch_all.return_value = tuple(
+                    (mail_id, _build_mail(to=to, from_=from_,
+                                          subject=subject))
+                    for mail_id, (to, from_, subject) in enumerate(mails, 1))
+                manager.process()
+                self.assertEqual(calls, handler.call_args_list)
+                manager.inbox.delete_many.assert_called_once_with(
+                    list(range(1, len(mails) + 1)))
+
+    def test_process_keeps_failed_mails(self):
         manager = self.build_manager()
         manager.inbox.fetch_all.return_value = (
-            (1, _build_mail(to=self.LIST_EMAIL, from_=self.EMAIL,
-                            subject='unsubscribe')),
-            (2, _build_mail(to=self.LIST_EMAIL, from_=self.EMAIL2,
-                            subject='   unsubscribe  ')),
+            (1, _build_mail(to=self.LIST_EMAIL, subject='subscribe')),
+            (2, _build_mail(to=self.LIST_EMAIL, subject='subscribe')),
         )
-        manager.send_deletion_key = mock.MagicMock()
-        manager.process()
-        self.assertEqual(2, manager.send_deletion_key.call_count)
-        manager.send_deletion_key.assert_has_calls([mock.call(self.EMAIL),
-                                                    mock.call(self.EMAIL2)])
-        manager.inbox.delete.assert_has_calls([mock.call(1), mock.call(2)])
+        manager.subscribe = mock.MagicMock(side_effect=[None, RuntimeError])
+        with self.assertLogs(level='ERROR'):
+            manager.process()
+        manager.inbox.delete_many.assert_called_once_with([1])
 
-    def test_process_verify(self):
+    def test_process_stops_on_terminate(self):
         manager = self.build_manager()
         manager.inbox.fetch_all.return_value = (
-            (1, _build_mail(to=self.LIST_EMAIL, from_=self.EMAIL,
-                            subject='Re: [Foolist] verify <%s>' % self.KEY)),
+            (1, _build_mail(to=self.LIST_EMAIL, subject='subscribe')),
+            (2, _build_mail(to=self.LIST_EMAIL, subject='subscribe')),
+            (3, _build_mail(to=self.LIST_EMAIL, subject='subscribe')),
         )
-        manager.verify = mock.MagicMock()
-        manager.process()
-        self.assertEqual(1, manager.verify.call_count)
-        manager.verify.assert_called_once_with(self.EMAIL, self.KEY)
-        manager.inbox.delete.assert_has_calls([mock.call(1)])
+        calls = []
+
+        def subscribe(addr):
+            calls.append(addr)
+            if len(calls) == 2:
+                # as if SIGTERM arrived while the mail is handled
+                ezlist._terminate(signal.SIGTERM, None)
+
+        manager.subscribe = mock.MagicMock(side_effect=subscribe)
+        with self.assertRaises(SystemExit):
+            manager.process()
+        self.assertEqual(2, manager.subscribe.call_count)
+        # the mail handled before the signal is still deleted
+        manager.inbox.delete_many.assert_called_once_with([1])
 
-    def test_process_unsubscribe(self):
+    def test_process_legacy_key(self):
         manager = self.build_manager()
         manager.inbox.fetch_all.return_value = (
             (1, _build_mail(to=self.LIST_EMAIL, from_=self.EMAIL,
-                            subject='unsubscribe <%s>' % self.KEY)),
+                            subject='unsubscribe <a+b/c==>')),
         )
         manager.unsubscribe = mock.MagicMock()
         manager.process()
-        self.assertEqual(1, manager.unsubscribe.call_count)
-        manager.unsubscribe.assert_called_once_with(self.EMAIL, self.KEY)
-        manager.inbox.delete.assert_has_calls([mock.call(1)])
+        manager.unsubscribe.assert_called_once_with(self.EMAIL, 'a+b/c==')
 
     def test_process_forward_with_skip_sender(self):
         manager = self.build_manager(skip_sender=True)
+        manager.storage.add_subscriber(self.EMAIL, self.KEY)
+        headers = _build_mail(from_=self.EMAIL, to=self.LIST_EMAIL,
+                              subject='Test something', text='')
         mail = _build_mail(from_=self.EMAIL, to=self.LIST_EMAIL,
                            subject='Test something')
-        manager.inbox.fetch_all.return_value = ((1, mail),)
+        manager.inbox.fetch_all.return_value = ((1, headers),)
+        manager.inbox.fetch_full.return_value = (mail, b'body')
         manager.forward = mock.MagicMock()
         manager.process()
         self.assertEqual(1, manager.forward.call_count)
-        manager.forward.assert_called_once_with(self.EMAIL, mail,
-                                                exclude=[self.EMAIL])
-        manager.inbox.delete.assert_has_calls([mock.call(1)])
+        manager.forward.assert_called_once_with(
+            self.EMAIL, mail, exclude=frozenset([self.EMAIL]), body=b'body')
+        manager.inbox.fetch_full.assert_called_once_with(1)
+        manager.inbox.delete_many.assert_called_once_with([1])
+
+    def test_process_forward_not_subscribed(self):
+        manager = self.build_manager()
+        headers = _build_mail(from_=self.EMAIL, to=self.LIST_EMAIL,
+                              subject='Buy now', text='')
+        manager.inbox.fetch_all.return_value = ((1, headers),)
+        with self.assertLogs(level='WARNING'):
+            manager.process()
+        # the rejected mail is never downloaded completely
+        manager.inbox.fetch_full.assert_not_called()
+        manager.sender.send_many.assert_not_called()
+        manager.inbox.delete_many.assert_called_once_with([1])
 
     def test_process_forward_without_skip_sender(self):
         manager = self.build_manager(skip_sender=False)
+        manager.storage.add_subscriber(self.EMAIL, self.KEY)
+        headers = _build_mail(from_=self.EMAIL, to=self.LIST_EMAIL,
+                              subject='Test something', text='')
         mail = _build_mail(from_=self.EMAIL, to=self.LIST_EMAIL,
                            subject='Test something')
-        manager.inbox.fetch_all.return_value = ((1, mail),)
+        manager.inbox.fetch_all.return_value = ((1, headers),)
+        manager.inbox.fetch_full.return_value = (mail, b'body')
         manager.forward = mock.MagicMock()
         manager.process()
         self.assertEqual(1, manager.forward.call_count)
-        manager.forward.assert_called_once_with(self.EMAIL, mail, exclude=[])
-        manager.inbox.delete.assert_has_calls([mock.call(1)])
+        manager.forward.assert_called_once_with(self.EMAIL, mail,
+                                                exclude=frozenset(),
+                                                body=b'body')
+        manager.inbox.fetch_full.assert_called_once_with(1)
+        manager.inbox.delete_many.assert_called_once_with([1])
 
     def test_integration(self):
-        manager = self.build_manager()
+        manager = self.build_manager(storage=ezlist.SQLiteStorage(':memory:'))
 
         # one subscriber is already present on the list
         manager.storage.add_subscriber(self.EMAIL2, self.KEY2)
@@ -437,7 +899,7 @@ class ManagerTest(unittest.TestCase):
         self.assertTrue(manager.sender.send.called)
 
         # verification step (replying to the mail)
-        mail = manager.sender.send.call_args[0][2]
+        mail = email.message_from_bytes(manager.sender.send.call_args[0][2])
         mail.replace_header('Subject', 'Re: %s' % mail['Subject'])
         mail.replace_header('From', self.EMAIL)
         mail.replace_header('To', self.LIST_EMAIL)
@@ -451,10 +913,12 @@ class ManagerTest(unittest.TestCase):
         mail = _build_mail(from_=self.EMAIL, to=self.LIST_EMAIL,
                            subject=subject)
         manager.inbox.fetch_all.return_value = ((1, mail),)
+        manager.inbox.fetch_full.return_value = (mail, None)
         manager.process()
         # when skipping the sender, there is one person left to mail
-        self.assertEqual(3, manager.sender.send.call_count)
-        mail = manager.sender.send.call_args[0][2]
+        self.assertEqual(1, manager.sender.send_many.call_count)
+        self.assertEqual([self.EMAIL2], _recipients(manager.sender.send_many))
+        mail = manager.sender.send_many.call_args[0][2]
         self.assertEqual('%s %s' % (self.SUBJECT_PREFIX, subject),
                          mail['Subject'])
 
@@ -463,10 +927,10 @@ class ManagerTest(unittest.TestCase):
                            subject='unsubscribe')
         manager.inbox.fetch_all.return_value = ((1, mail),)
         manager.process()
-        self.assertEqual(4, manager.sender.send.call_count)
+        self.assertEqual(3, manager.sender.send.call_count)
 
         # reply to fully unsubscribe
-        mail = manager.sender.send.call_args[0][2]
+        mail = email.message_from_bytes(manager.sender.send.call_args[0][2])
         mail.replace_header('Subject', 'Re: %s' % mail['Subject'])
         mail.replace_header('From', self.EMAIL)
         mail.replace_header('To', self.LIST_EMAIL)
@@ -482,7 +946,7 @@ class ManagerTest(unittest.TestCase):
         mail['From'] = self.EMAIL
         mail['To'] = self.LIST_EMAIL
         manager.forward(self.EMAIL, mail)
-        mail = manager.sender.send.call_args[0][2]
+        mail = manager.sender.send_many.call_args[0][2]
         self.assertEqual('%s (empty subject)' % self.SUBJECT_PREFIX,
                          mail['Subject'])
 